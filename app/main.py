@@ -2,24 +2,35 @@
 import os
 import sys
 import tempfile
-from tempfile import NamedTemporaryFile
 import warnings
 import shutil
 import json
+import hashlib
+import functools
 import io
 import zipfile
 import re
-import unicodedata
+import html
 
 # 导入第三方库
 import streamlit as st
 import pandas as pd
 from docx import Document
+from openpyxl import load_workbook
 from dataclasses import dataclass
-from typing import List, Optional, Dict, Tuple
-from collections import defaultdict
+from typing import Optional, Dict, Tuple
 from decimal import Decimal, ROUND_HALF_UP
 
+# 导入项目模块
+from replacer import (
+    SCOPE_FULL_KEYWORD,
+    SCOPE_BRACKET_CONTENT,
+    clean_text,
+    clean_filename,
+    prepare_replace_rules,
+    replace_rows,
+)
+
 # 项目版本信息
 VERSION = "v1.2.3"
 
@@ -27,6 +38,10 @@ VERSION = "v1.2.3"
 PAGE_SIZE = 10  # 每页显示的文件数
 WIDGET_HEIGHT = 300  # 组件高度
 PREVIEW_ROWS = 30  # 数据预览行数
+UPLOAD_CACHE_ENTRIES = 4  # 上传文件解析结果的缓存条目上限
+LOG_TAIL_LINES = 500  # 页面上显示的日志行数（完整日志可下载）
+ZIP_CACHE_ENTRIES = 2  # 已打包ZIP的缓存条目上限
+ZIP_CACHE_TTL = 300  # 已打包ZIP的缓存有效期（秒），过期后不再保留用户文档内容
 
 # 过滤特定警告，避免干扰用户界面
 warnings.filterwarnings("ignore", category=UserWarning)
@@ -102,12 +117,12 @@ class ReplacedFile:
     
     Attributes:
         filename: 替换后的文件名
-        data: 文件二进制数据
+        path: 文件在会话结果目录中的存储路径
         row_idx: 对应Excel行号（从0开始）
         log: 替换日志信息
     """
     filename: str  # 文件名
-    data: io.BytesIO  # 文件二进制数据
+    path: str  # 文件存储路径（内容保存在磁盘上，不常驻内存）
     row_idx: int  # 对应Excel行号
     log: str  # 替换日志
 
@@ -115,12 +130,15 @@ def init_session_state():
     """初始化会话状态，确保所有必要的键都存在"""
     required_states = {
         "replace_rules": [],  # 替换规则列表：[(关键词, Excel列名), ...]
+        "rules_version": 0,  # 规则版本号，规则增删时递增，用于判断规则是否变化
         "replaced_files": [],  # 替换后的文件列表
         "replace_log": [],  # 替换日志
+        "replace_log_text": "",  # 页面显示的日志文本（最后LOG_TAIL_LINES行，每批替换只拼接一次）
         "is_replacing": False,  # 替换中状态标识，防止重复提交
         "clear_input": False,  # 输入框清空控制
         "replace_params": {},  # 替换参数（用于判断是否需要重新替换）
-        "replace_scope": "替换完整关键词",  # 替换范围选项
+        "replace_scope": SCOPE_FULL_KEYWORD,  # 替换范围选项
+        "result_dir": None,  # 当前会话的结果文件目录（TemporaryDirectory，会话状态释放时自动删除）
     }
 
     for key, default in required_states.items():
@@ -130,189 +148,55 @@ def init_session_state():
 # 调用会话状态初始化函数
 init_session_state()
 
-# ---------------------- 核心工具函数 ----------------------
-def clean_text(text: str) -> str:
-    """清理文本：去除首尾空白、隐藏字符、特殊空格，统一格式
-    
-    Args:
-        text: 输入文本
-        
-    Returns:
-        清理后的文本
-    """
-    if not isinstance(text, str):
-        return ""
-    text = text.strip()  # 去除首尾空白
-    text = unicodedata.normalize("NFKC", text)  # 标准化字符（处理全角/半角等）
-    text = re.sub(r'[\u00A0\u2002-\u200B]', ' ', text)  # 替换特殊空格
-    text = re.sub(r'\s+', ' ', text)  # 合并连续空格
-    return text
-
 
-def clean_filename(filename: str) -> str:
-    """清理文件名非法字符
+def reset_result_dir() -> str:
+    """为新一批替换结果创建空的结果目录，并删除本会话上一批的结果文件
     
-    Args:
-        filename: 原始文件名
-        
-    Returns:
-        清理后的合法文件名
-    """
-    return re.sub(r'[\\/:*?"<>|]', "_", str(filename))
-
-
-# ---------------------- 替换核心逻辑 ----------------------
-def precompute_replace_patterns(replace_rules: List[Tuple[str, str]], excel_row: pd.Series) -> List[Tuple[str, str, str, str]]:
-    """预计算所有需要替换的模式和对应的替换值，减少重复计算
+    替换结果写入磁盘，会话状态中只保存路径，避免大批量结果常驻内存；
+    目录对象保存在会话状态中，会话结束、会话状态被释放时目录随之删除，不会残留用户数据。
     
-    Args:
-        replace_rules: 替换规则列表
-        excel_row: 当前处理的Excel行数据
-        
     Returns:
-        替换模式列表：[(原始关键词, 列名, 清理后关键词, 替换值), ...]
+        新的结果目录路径
     """
-    replace_patterns = []
-    
-    for old_text, col_name in replace_rules:
-        # 获取Excel中对应列的替换值
-        replacement = str(excel_row[col_name])
-        # 清理用户输入的关键词
-        cleaned_text = clean_text(old_text)
-        
-        # 根据替换范围选项生成替换值
-        if st.session_state.replace_scope == "仅替换括号内内容":
-            # 检查是否是带括号的格式，只替换括号内的内容
-            if cleaned_text.startswith("【") and cleaned_text.endswith("】"):
-                # 保留方括号，替换内容
-                new_format = f"【{replacement}】"
-                replace_patterns.append((old_text, col_name, cleaned_text, new_format))
-            elif cleaned_text.startswith("（") and cleaned_text.endswith("）"):
-                # 保留中文圆括号，替换内容
-                new_format = f"（{replacement}）"
-                replace_patterns.append((old_text, col_name, cleaned_text, new_format))
-            elif cleaned_text.startswith("(") and cleaned_text.endswith(")"):
-                # 保留英文圆括号，替换内容
-                new_format = f"({replacement})"
-                replace_patterns.append((old_text, col_name, cleaned_text, new_format))
-            elif cleaned_text.startswith("〔") and cleaned_text.endswith("〕"):
-                # 保留六角括号，替换内容
-                new_format = f"〔{replacement}〕"
-                replace_patterns.append((old_text, col_name, cleaned_text, new_format))
-            else:
-                # 非括号格式，直接替换
-                replace_patterns.append((old_text, col_name, cleaned_text, replacement))
-        else:
-            # 替换完整关键词
-            replace_patterns.append((old_text, col_name, cleaned_text, replacement))
-    
-    return replace_patterns
+    if st.session_state.result_dir is not None:
+        st.session_state.result_dir.cleanup()
+    st.session_state.result_dir = tempfile.TemporaryDirectory(prefix="word_replace_")
+    return st.session_state.result_dir.name
 
 
-def process_paragraph(paragraph, replace_patterns: List[Tuple[str, str, str, str]], cleaned_para: str = None) -> Dict:
-    """处理单个段落的关键字替换，避免重复代码
+@st.cache_data(show_spinner=False, max_entries=ZIP_CACHE_ENTRIES, ttl=ZIP_CACHE_TTL)
+def build_zip(entries: Tuple[Tuple[str, str], ...]) -> bytes:
+    """将替换结果打包为ZIP，结果按文件列表短时缓存，短时间内重复下载同一批结果时无需重新打包
+    
+    .docx本身已是压缩格式，使用ZIP_STORED直接存储，避免重复压缩；
+    各文件从结果目录逐个读入归档，打包过程直接写入磁盘临时文件，只在最后读取一次。
     
     Args:
-        paragraph: 要处理的段落对象
-        replace_patterns: 替换模式列表
-        cleaned_para: 预清理的段落文本（可选）
+        entries: 待打包的文件：((文件名, 存储路径), ...)，每批结果的存储路径唯一，可直接作为缓存键
         
     Returns:
-        替换计数字典：{(原始关键词, 列名): 替换次数, ...}
+        ZIP文件内容
     """
-    para_text = paragraph.text
-    if cleaned_para is None:
-        cleaned_para = clean_text(para_text)
-    replace_count = defaultdict(int)
-    has_keyword = False
-    
-    # 检查段落是否包含任何需要替换的关键字（优化性能，避免不必要的处理）
-    for old_text, col_name, format_keyword, replacement in replace_patterns:
-        if format_keyword in cleaned_para:
-            has_keyword = True
-            break
-    
-    if has_keyword:
-        # 创建新文本并替换所有关键字
-        new_text = para_text
-        for old_text, col_name, format_keyword, replacement in replace_patterns:
-            if format_keyword in cleaned_para:
-                new_text = new_text.replace(format_keyword, replacement)
-                replace_count[(old_text, col_name)] += 1
-        
-        # 清空所有现有Run并添加新的Run（保留格式）
-        if len(paragraph.runs) > 0:
-            # 保留第一个Run的格式
-            paragraph.runs[0].text = new_text
-            # 清空其他Run
-            for i in range(1, len(paragraph.runs)):
-                paragraph.runs[i].text = ''
-    
-    return replace_count
+    with tempfile.TemporaryFile() as archive:
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as zipf:
+            for filename, path in entries:
+                zipf.write(path, arcname=filename)
+        archive.seek(0)
+        return archive.read()
 
 
-def replace_word_with_format(word_file: st.runtime.uploaded_file_manager.UploadedFile, 
-                          excel_row: pd.Series, 
-                          replace_rules: List[Tuple[str, str]]) -> Tuple[io.BytesIO, str]:
-    """替换Word文件中的关键字，保留格式并返回替换后的文件
-    
-    Args:
-        word_file: 上传的Word文件
-        excel_row: 当前Excel行数据
-        replace_rules: 替换规则列表
-        
-    Returns:
-        (替换后的文件数据, 替换日志)
-    """
-    replace_count = defaultdict(int)
-    replace_log = []
-    
-    try:
-        # 直接从内存加载Word文档（优化：避免创建临时文件）
-        doc = Document(io.BytesIO(word_file.getvalue()))
-        
-        # 预计算替换模式，减少重复计算（优化性能）
-        replace_patterns = precompute_replace_patterns(replace_rules, excel_row)
-        
-        # 1. 处理段落
-        for paragraph in doc.paragraphs:
-            para_count = process_paragraph(paragraph, replace_patterns)
-            for key, count in para_count.items():
-                replace_count[key] += count
-        
-        # 2. 处理表格（支持表格内文字替换）
-        for table in doc.tables:
-            for row in table.rows:
-                for cell in row.cells:
-                    for paragraph in cell.paragraphs:
-                        para_count = process_paragraph(paragraph, replace_patterns)
-                        for key, count in para_count.items():
-                            replace_count[key] += count
-        
-        # 保存修改后的文档
-        output_file = io.BytesIO()
-        doc.save(output_file)
-        output_file.seek(0)  # 重置文件指针到开头
-        
-        # 生成替换日志
-        if replace_count:
-            log_lines = [f"替换成功: {old} -> {excel_row[col_name]} ({count}次)" 
-                        for (old, col_name), count in replace_count.items()]
-            replace_log = "\n".join(log_lines)
-        else:
-            replace_log = "未找到需要替换的关键字"
-            
-        return output_file, replace_log
-        
-    except Exception as e:
-        # 生成详细错误日志
-        import traceback
-        error_log = f"替换失败: {str(e)}\n{traceback.format_exc()}"
-        return io.BytesIO(), error_log
+def read_result_file(path: str) -> bytes:
+    """读取结果文件内容（用作下载按钮的延迟数据源）"""
+    with open(path, "rb") as f:
+        return f.read()
+
+# ---------------------- 替换参数与Excel处理 ----------------------
+_FLOAT_RE = re.compile(r'[-+]?\d*\.?\d+')  # 浮点数格式（整体匹配）
 
 
 def get_replace_params(
         word_file: Optional[st.runtime.uploaded_file_manager.UploadedFile],
+        excel_file: Optional[st.runtime.uploaded_file_manager.UploadedFile],
         excel_df: Optional[pd.DataFrame],
         start_row: int,
         end_row: int,
@@ -320,10 +204,15 @@ def get_replace_params(
         file_prefix: str,
         file_suffix: str
 ) -> Dict:
-    """获取替换参数哈希，用于判断是否需要重新替换
+    """获取替换参数，用于判断是否需要重新替换
+    
+    规则只比较版本号（增删规则时递增），不随规则数量增加而变慢；
+    替换范围与上传文件合并为一个稳定的摘要（不受Python哈希随机化影响），
+    Excel只取文件开头部分参与计算，足以识别文件是否被更换。
     
     Args:
         word_file: 上传的Word文件
+        excel_file: 上传的Excel文件
         excel_df: Excel数据框
         start_row: 起始行
         end_row: 结束行
@@ -334,6 +223,14 @@ def get_replace_params(
     Returns:
         替换参数字典
     """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(st.session_state.replace_scope.encode("utf-8"))
+    digest.update(str(word_file.size if word_file else 0).encode("utf-8"))
+    if excel_file:
+        # getbuffer返回内存视图，只取开头部分，不复制整个文件
+        with excel_file.getbuffer() as excel_buffer:
+            digest.update(excel_buffer[:4096])
+    
     return {
         "word_filename": word_file.name if word_file else "",
         "excel_rows": len(excel_df) if excel_df is not None else 0,
@@ -342,8 +239,8 @@ def get_replace_params(
         "file_name_col": file_name_col,
         "file_prefix": file_prefix,
         "file_suffix": file_suffix,
-        "rule_count": len(st.session_state.replace_rules),
-        "rule_hash": hash(tuple(st.session_state.replace_rules))  # 使用哈希值快速比较规则是否变化
+        "rules_version": st.session_state.rules_version,
+        "fingerprint": digest.hexdigest()  # 替换范围与文件的稳定摘要，快速比较是否变化
     }
 
 
@@ -371,11 +268,17 @@ def fix_float_precision(x: str, column_name: Optional[str] = None) -> str:
     if x.isdigit():
         return x
     
-    # 使用更宽松的正则表达式检查是否是浮点数格式
-    float_pattern = r'^\s*[-+]?\d*\.?\d+\s*$'
-    if not re.match(float_pattern, x):
+    # 检查是否是浮点数格式（已去除首尾空格，整体匹配即可）
+    if not _FLOAT_RE.fullmatch(x):
         return x
-    
+
+    # 快速路径：非合计列的小数只有在浮点表示出现连续的9或0时才需要修复，
+    # 其余情况原样返回，无需构造Decimal
+    if '.' in x and not is_total_column(column_name):
+        float_str = str(float(x))
+        if '999999' not in float_str and '000000' not in float_str:
+            return x
+
     try:
         # 使用Decimal进行更精确的计算
         dec_value = Decimal(x)
@@ -389,7 +292,7 @@ def fix_float_precision(x: str, column_name: Optional[str] = None) -> str:
         float_str = str(float_val)
         
         # 特别针对合计列的处理
-        if column_name and ("合计" in column_name or "total" in column_name.lower()):
+        if is_total_column(column_name):
             # 合计列通常需要2-4位小数
             # 尝试保留2-6位小数，找到最合适的
             for dec_places in range(2, 7):
@@ -436,12 +339,57 @@ def fix_float_precision(x: str, column_name: Optional[str] = None) -> str:
         try:
             float_val = float(x)
             # 默认保留6位小数
-            return format(float_val, '.6f').rstrip('0').rstrip('.') if '.' in format(float_val, '.6f') else format(float_val, '.6f')
+            formatted = format(float_val, '.6f')
+            return formatted.rstrip('0').rstrip('.') if '.' in formatted else formatted
         except:
             # 如果所有方法都失败，返回原始字符串
             return x
 
 
+def is_total_column(column_name: Optional[str]) -> bool:
+    """判断是否为合计列（合计列的数值需要特殊的精度处理）"""
+    return bool(column_name) and ("合计" in column_name or "total" in column_name.lower())
+
+
+def fix_float_precision_series(series: pd.Series, column_name: Optional[str] = None) -> pd.Series:
+    """对整列数据做浮点数精度修复，结果与逐个调用fix_float_precision一致
+    
+    先用向量化的字符串操作筛选出可能需要修复的单元格，只对这些单元格调用fix_float_precision，
+    避免对每个单元格都构造Decimal。非合计列中，不超过15个字符的小数可精确往返float，
+    只有其数字本身含有连续的9或0时才可能出现精度问题特征，因此只需处理：
+    超长数值、含"999999"/"000000"的数值以及带符号的数值（整数需规范化）。
+    
+    Args:
+        series: 已去除首尾空格的字符串列
+        column_name: 列名（用于特殊处理，如合计列）
+        
+    Returns:
+        修复后的列
+    """
+    if is_total_column(column_name):
+        # 合计列的所有小数都需要处理
+        candidates = series.str.fullmatch(_FLOAT_RE, na=False)
+    else:
+        # 先用廉价条件预筛选，再做格式匹配
+        candidates = (
+            (series.str.len() > 15)
+            | series.str.contains("999999|000000", regex=True)
+            | series.str.match(r'[-+]')
+        ).fillna(False)
+        if not candidates.any():
+            return series
+        candidates &= series.str.fullmatch(_FLOAT_RE, na=False)
+    
+    # 纯整数无需处理
+    candidates &= ~series.str.isdigit().fillna(False)
+    if not candidates.any():
+        return series
+    
+    series = series.copy()
+    series[candidates] = series[candidates].map(lambda x: fix_float_precision(x, column_name))
+    return series
+
+
 def clean_excel_types(df: pd.DataFrame) -> pd.DataFrame:
     """清理Excel数据类型，避免混合类型导致的序列化错误，并修复数值精度问题
     
@@ -451,27 +399,114 @@ def clean_excel_types(df: pd.DataFrame) -> pd.DataFrame:
     Returns:
         清理后的数据框
     """
-    df_clean = df.copy()
+    # 逐列清理后一次性构建新数据框，不复制原数据框，也不逐列改名、回写
+    cleaned_columns = {}
     
-    for col in df_clean.columns:
+    for col in df.columns:
+        # 确保列名是字符串
+        col_name = str(col)
         try:
-            # 确保列名是字符串
-            col_name = str(col)
-            if col_name != col:
-                df_clean = df_clean.rename(columns={col: col_name})
-                col = col_name
-            
-            # 1. 处理空值 - 只处理真正的空值，保留字符串类型的空字符串
-            df_clean[col] = df_clean[col].fillna("")
-            
-            # 2. 只去除前后空格，不做任何其他类型转换
-            df_clean[col] = df_clean[col].str.strip()
-            
+            # 处理空值（只处理真正的空值）并去除前后空格，不做任何其他类型转换；
+            # 再修复浮点数精度（传递字符串列名，以便针对不同列进行特殊处理；数字列名同样按完整精度处理）
+            cleaned_columns[col_name] = fix_float_precision_series(df[col].fillna("").str.strip(), col_name)
         except Exception as e:
-            # 出现错误时，强制转换为字符串并去除空格
-            df_clean[col] = df_clean[col].astype(str).str.strip()
+            # 出现错误时，空值置为空字符串，其余强制转换为字符串并去除空格
+            cleaned_columns[col_name] = df[col].fillna("").astype(str).str.strip()
+    
+    return pd.DataFrame(cleaned_columns, index=df.index)
+
+
+@st.cache_data(show_spinner=False, max_entries=UPLOAD_CACHE_ENTRIES)
+def load_excel(data: bytes) -> Tuple[str, pd.DataFrame]:
+    """读取Excel第一个工作表并清理数据类型，结果按文件内容缓存
+    
+    Args:
+        data: Excel文件内容
+        
+    Returns:
+        (工作表名称, 清理后的数据框)
+    """
+    # 直接从内存读取Excel（避免写入临时文件）
+    excel_io = io.BytesIO(data)
+    
+    # 只读模式获取第一个工作表名称，仅解析工作簿结构，不加载单元格
+    excel_wb = load_workbook(excel_io, read_only=True, data_only=True)
+    try:
+        selected_sheet = excel_wb.sheetnames[0]  # 默认使用第一个工作表
+    finally:
+        excel_wb.close()
+    
+    # 使用pandas直接读取第一个工作表，但避免自动类型转换
+    excel_io.seek(0)
+    excel_df = pd.read_excel(
+        excel_io,
+        sheet_name=0,
+        engine="openpyxl",
+        dtype=str,  # 以字符串形式读取所有列
+        keep_default_na=False,  # 不自动将空值转换为NaN
+        na_values=[]  # 不将任何值视为NA
+    )
+    
+    # 清理数据类型并修复浮点数精度
+    return selected_sheet, clean_excel_types(excel_df)
+
+
+def _is_bold_run(r) -> bool:
+    """判断Run是否直接设置了加粗（与python-docx的Run.bold判断一致）"""
+    b_val = r.xpath("./w:rPr/w:b/@w:val")
+    return bool(r.xpath("./w:rPr/w:b")) and (not b_val or b_val[0] not in ("0", "false", "off"))
+
+
+@st.cache_data(show_spinner=False, max_entries=UPLOAD_CACHE_ENTRIES)
+def render_word_preview(data: bytes) -> str:
+    """生成Word文档的HTML预览（含段落基本格式与表格），结果按文件内容缓存
+    
+    文档文本均经过HTML转义，避免<、&等字符破坏预览结构。
     
-    return df_clean
+    Args:
+        data: Word文件内容
+        
+    Returns:
+        预览HTML
+    """
+    # 直接从内存加载Word文档，避免创建临时文件
+    doc = Document(io.BytesIO(data))
+    # 各片段先收集到列表，最后一次性拼接，避免字符串反复拼接
+    parts = ["<div style='height: 280px; overflow-y: auto; padding: 8px; border: 1px solid #eee; font-size: 13px; line-height: 1.5;'>"]
+
+    # 段落预览（包含基本格式）
+    for paragraph in doc.paragraphs:
+        if paragraph.text.strip():
+            parts.append("<p style='margin: 3px 0;'>")
+            for run in paragraph.runs:
+                style = ""
+                if run.bold: style += "font-weight: bold;"
+                if run.italic: style += "font-style: italic;"
+                if run.font.color and run.font.color.rgb:
+                    style += f"color: #{run.font.color.rgb:06X}; "
+                text = html.escape(run.text)
+                parts.append(f"<span style='{style}'>{text}</span>" if style else text)
+            parts.append("</p>")
+
+    # 表格预览：用XPath直接遍历表格XML（w:tbl/w:tr/w:tc/w:p/w:r），不构建python-docx的行、单元格、段落对象
+    for table_idx, tbl in enumerate(doc.element.body.xpath("./w:tbl")):
+        parts.append(f"<div style='margin: 8px 0; font-weight: bold;'>表格{table_idx + 1}：</div>")
+        parts.append("<table border='1' style='border-collapse: collapse; width: 100%; border: 1px solid #ccc;'>")
+        for tr in tbl.xpath("./w:tr"):
+            parts.append("<tr>")
+            for tc in tr.xpath("./w:tc"):
+                # 横向合并的单元格只出现一次，用colspan保持列对齐
+                grid_span = tc.xpath("./w:tcPr/w:gridSpan/@w:val")
+                colspan = f" colspan='{grid_span[0]}'" if grid_span else ""
+                parts.append(f"<td{colspan} style='padding: 6px; vertical-align: top; font-size: 12px;'>")
+                for r in tc.xpath("./w:p/w:r"):
+                    text = html.escape(r.text)
+                    parts.append(f"<span style='font-weight: bold;'>{text}</span>" if _is_bold_run(r) else text)
+                parts.append("</td>")
+            parts.append("</tr>")
+        parts.append("</table>")
+    parts.append("</div>")
+    return "".join(parts)
 
 # ---------------------- 页面标题与简介 ----------------------
 st.title("📋 Word+Excel批量替换工具")
@@ -527,42 +562,8 @@ with st.container(border=True):
         st.markdown("#### Word预览（含表格）")
         if word_file:
             try:
-                # 直接从内存加载Word文档，避免创建临时文件
-                doc = Document(io.BytesIO(word_file.getvalue()))
-                word_html = "<div style='height: 280px; overflow-y: auto; padding: 8px; border: 1px solid #eee; font-size: 13px; line-height: 1.5;'>"
-
-                # 段落预览（包含基本格式）
-                for paragraph in doc.paragraphs:
-                    if paragraph.text.strip():
-                        para_html = "<p style='margin: 3px 0;'>"
-                        for run in paragraph.runs:
-                            style = ""
-                            if run.bold: style += "font-weight: bold;"
-                            if run.italic: style += "font-style: italic;"
-                            if run.font.color and run.font.color.rgb:
-                                style += f"color: #{run.font.color.rgb:06X}; "
-                            para_html += f"<span style='{style}'>{run.text}</span>" if style else run.text
-                        para_html += "</p>"
-                        word_html += para_html
-
-                # 表格预览
-                for table_idx, table in enumerate(doc.tables):
-                    word_html += f"<div style='margin: 8px 0; font-weight: bold;'>表格{table_idx + 1}：</div>"
-                    word_html += "<table border='1' style='border-collapse: collapse; width: 100%; border: 1px solid #ccc;'>"
-                    for row in table.rows:
-                        word_html += "<tr>"
-                        for cell in row.cells:
-                            cell_html = "<td style='padding: 6px; vertical-align: top; font-size: 12px;'>"
-                            for para in cell.paragraphs:
-                                for run in para.runs:
-                                    style = ""
-                                    if run.bold: style += "font-weight: bold;"
-                                    cell_html += f"<span style='{style}'>{run.text}</span>" if style else run.text
-                            cell_html += "</td>"
-                            word_html += cell_html
-                        word_html += "</tr>"
-                    word_html += "</table>"
-                word_html += "</div>"
+                # 预览HTML按文件内容缓存，重新运行页面时无需再次解析
+                word_html = render_word_preview(word_file.getvalue())
 
                 # 显示HTML预览
                 st.components.v1.html(word_html, height=300)
@@ -583,61 +584,27 @@ with st.container(border=True):
         st.markdown("#### Excel数据预览")
         if excel_file:
             try:
-                # 创建临时文件并保存上传的Excel内容
-                with NamedTemporaryFile(delete=False, suffix='.xlsx') as temp_excel:
-                    temp_excel.write(excel_file.getvalue())
-                    excel_path = temp_excel.name
-                
-                try:
-                    # 使用上下文管理器自动关闭Excel文件句柄，避免资源泄漏
-                    with pd.ExcelFile(excel_path, engine="openpyxl") as excel_wb:
-                        sheet_names = excel_wb.sheet_names
-                        selected_sheet = sheet_names[0]  # 默认使用第一个工作表
-                        st.markdown(f"⚠️ 当前使用工作表：{selected_sheet}", unsafe_allow_html=True)
-                        
-                        # 使用pandas读取Excel，但避免自动类型转换
-                        excel_df = pd.read_excel(
-                            excel_wb,
-                            sheet_name=selected_sheet,
-                            dtype=str,  # 以字符串形式读取所有列
-                            keep_default_na=False,  # 不自动将空值转换为NaN
-                            na_values=[]  # 不将任何值视为NA
-                        )
-                    
-                    # 对所有列应用浮点数精度修复
-                    for col in excel_df.columns:
-                        # 传递列名给修复函数，以便针对不同列进行特殊处理
-                        excel_df[col] = excel_df[col].apply(lambda x: fix_float_precision(x, col))
-                    
-                    # 清理数据类型
-                    excel_df = clean_excel_types(excel_df)
-                    excel_cols = excel_df.columns.tolist()
-
-                    # 显示处理后的数据预览（最多显示PREVIEW_ROWS行）
-                    preview_df = excel_df.head(PREVIEW_ROWS)
-                    st.dataframe(
-                        preview_df,
-                        width='stretch',
-                        height=250,
-                        hide_index=True
-                    )
+                # 读取与清理结果按文件内容缓存，重新运行页面时无需再次解析和修复精度
+                selected_sheet, excel_df = load_excel(excel_file.getvalue())
+                st.markdown(f"⚠️ 当前使用工作表：{selected_sheet}", unsafe_allow_html=True)
+                excel_cols = excel_df.columns.tolist()
 
-                    # 数据统计信息
-                    st.markdown(f"""
-                    <div style='margin-top: 10px; font-size: 13px; color: #666;'>
-                    数据统计：共 {len(excel_df)} 行 × {len(excel_cols)} 列<br>
-                    列名：{', '.join(excel_cols[:5])}{'...' if len(excel_cols) > 5 else ''}
-                    </div>
-                    """, unsafe_allow_html=True)
-                    
-                finally:
-                    # 确保临时文件被删除，添加错误处理
-                    try:
-                        if 'excel_path' in locals() and os.path.exists(excel_path):
-                            os.unlink(excel_path)
-                    except Exception as e:
-                        # 记录警告但不中断程序
-                        st.warning(f"⚠️ 清理临时Excel文件失败：{str(e)}", icon="ℹ️")
+                # 显示处理后的数据预览（最多显示PREVIEW_ROWS行）
+                preview_df = excel_df.head(PREVIEW_ROWS)
+                st.dataframe(
+                    preview_df,
+                    width='stretch',
+                    height=250,
+                    hide_index=True
+                )
+
+                # 数据统计信息
+                st.markdown(f"""
+                <div style='margin-top: 10px; font-size: 13px; color: #666;'>
+                数据统计：共 {len(excel_df)} 行 × {len(excel_cols)} 列<br>
+                列名：{', '.join(excel_cols[:5])}{'...' if len(excel_cols) > 5 else ''}
+                </div>
+                """, unsafe_allow_html=True)
 
             except Exception as e:
                 st.error(f"❌ Excel读取失败：{str(e)}", icon="❌")
@@ -660,7 +627,7 @@ with st.container(border=True):
     st.markdown("<div style='font-size: 15px; font-weight: bold; margin-top: 10px; margin-bottom: 8px;'>替换范围设置</div>", unsafe_allow_html=True)
     st.radio(
         "替换范围",
-        options=["替换完整关键词", "仅替换括号内内容"],
+        options=[SCOPE_FULL_KEYWORD, SCOPE_BRACKET_CONTENT],
         key="replace_scope",
         index=0,
         horizontal=True,
@@ -694,6 +661,7 @@ with st.container(border=True):
                 for rule in valid_rules:
                     if rule not in st.session_state.replace_rules:
                         st.session_state.replace_rules.append(rule)
+                st.session_state.rules_version += 1
                 
                 st.success(f"✅ 成功导入 {len(valid_rules)} 条规则", icon="✅")
                 st.rerun()  # 重新运行应用以更新界面
@@ -757,6 +725,7 @@ with st.container(border=True):
             st.warning("⚠️ 该规则已存在", icon="⚠️")
         else:
             st.session_state.replace_rules.append(rule)
+            st.session_state.rules_version += 1
             st.success("✅ 规则添加成功", icon="✅")
             st.session_state.clear_input = True
             st.rerun()  # 重新运行应用以清空输入框
@@ -774,6 +743,7 @@ with st.container(border=True):
                 # 清空所有规则按钮
                 if st.button("清空所有规则", key="clear_rules", type="secondary", use_container_width=True):
                     st.session_state.replace_rules.clear()
+                    st.session_state.rules_version += 1
                     st.success("✅ 所有规则已清空", icon="✅")
                     st.session_state.replaced_files = []  # 清除已替换文件
                     st.rerun()
@@ -807,6 +777,7 @@ with st.container(border=True):
                         # 直接删除按钮
                         if st.button("删除", key=f"delete_{idx}", type="primary", use_container_width=True):
                             st.session_state.replace_rules.pop(idx)
+                            st.session_state.rules_version += 1
                             st.success(f"✅ 已删除规则 {idx+1}", icon="✅")
                             st.session_state.replaced_files = []  # 清除已替换文件
                             st.rerun()
@@ -886,7 +857,7 @@ with st.container(border=True):
     
     # 获取当前替换参数
     current_params = get_replace_params(
-        word_file, excel_df, start_row, end_row, file_name_col, file_prefix, file_suffix
+        word_file, excel_file, excel_df, start_row, end_row, file_name_col, file_prefix, file_suffix
     )
     
     # 判断是否需要重新替换
@@ -919,55 +890,64 @@ with st.container(border=True):
         st.session_state.is_replacing = True
         st.session_state.replaced_files = []  # 清空之前的结果
         st.session_state.replace_log = []  # 清空之前的日志
+        st.session_state.replace_log_text = ""
         
         try:
-            # 处理指定范围的Excel行
-            for row_idx in range(start_row - 1, min(end_row, len(excel_df))):
-                excel_row = excel_df.iloc[row_idx]
-                
-                # 执行替换
-                replaced_file, replace_log = replace_word_with_format(
-                    word_file, excel_row, st.session_state.replace_rules
-                )
+            # 规则关键词只需清理一次，避免每行重复计算
+            cleaned_rules = prepare_replace_rules(st.session_state.replace_rules)
+            
+            # 处理指定范围的Excel行：整段一次性转换为普通字典（避免逐行构造Series），便于传递给子进程
+            rows = list(enumerate(excel_df.iloc[start_row - 1:end_row].to_dict("records"), start=start_row - 1))
+            
+            # 结果文件写入本会话的结果目录（以行号命名，避免同名文件互相覆盖）
+            result_dir = reset_result_dir()
+            
+            # 结果与日志先收集到局部列表，完成后一次性写入会话状态
+            replaced_files = []
+            log_lines = []
+            
+            # 多进程并行替换，结果按行号顺序返回；进度条约每1%刷新一次，避免逐行向前端推送更新
+            row_count = len(rows)
+            progress_step = max(1, row_count // 100)
+            progress_bar = st.progress(0.0, text="🔄 正在替换...")
+            results = replace_rows(word_file.getvalue(), rows, cleaned_rules, st.session_state.replace_scope)
+            for done, ((row_idx, excel_row), (_, replaced_file, replace_log)) in enumerate(zip(rows, results), start=1):
+                if done % progress_step == 0 or done == row_count:
+                    progress_bar.progress(done / row_count, text=f"🔄 正在替换：{done}/{row_count}")
                 
-                # 生成文件名
+                # 生成文件名：前缀 + 核心字段值（无核心字段时为“替换结果_行号”） + 后缀，并清理非法字符
                 if file_name_col and file_name_col in excel_row:
                     base_name = clean_text(excel_row[file_name_col])
-                    if file_prefix and file_suffix:
-                        filename = f"{file_prefix}{base_name}{file_suffix}.docx"
-                    elif file_prefix:
-                        filename = f"{file_prefix}{base_name}.docx"
-                    elif file_suffix:
-                        filename = f"{base_name}{file_suffix}.docx"
-                    else:
-                        filename = f"{base_name}.docx"
                 else:
-                    if file_prefix and file_suffix:
-                        filename = f"{file_prefix}替换结果_{row_idx + 1}{file_suffix}.docx"
-                    elif file_prefix:
-                        filename = f"{file_prefix}替换结果_{row_idx + 1}.docx"
-                    elif file_suffix:
-                        filename = f"替换结果_{row_idx + 1}{file_suffix}.docx"
-                    else:
-                        filename = f"替换结果_{row_idx + 1}.docx"
+                    base_name = f"替换结果_{row_idx + 1}"
+                filename = clean_filename(f"{file_prefix}{base_name}{file_suffix}.docx")
                 
-                # 清理文件名
-                filename = clean_filename(filename)
+                # 写入磁盘，结果列表中只保存路径
+                file_path = os.path.join(result_dir, f"{row_idx + 1}.docx")
+                with open(file_path, "wb") as f:
+                    f.write(replaced_file)
                 
                 # 添加到结果列表
-                st.session_state.replaced_files.append(ReplacedFile(
+                replaced_files.append(ReplacedFile(
                     filename=filename,
-                    data=replaced_file,
+                    path=file_path,
                     row_idx=row_idx,
                     log=replace_log
                 ))
                 
                 # 记录日志
-                st.session_state.replace_log.append(f"第{row_idx + 1}行：{replace_log}")
+                log_lines.append(f"第{row_idx + 1}行：{replace_log}")
+            
+            progress_bar.empty()
+            
+            st.session_state.replaced_files = replaced_files
+            st.session_state.replace_log = log_lines
+            # 页面只显示最后LOG_TAIL_LINES行日志，在此一次性拼接，页面重新运行时直接复用
+            st.session_state.replace_log_text = "\n".join(log_lines[-LOG_TAIL_LINES:])
             
             # 保存替换参数，用于后续判断是否需要重新替换
             st.session_state.replace_params = current_params
-            st.success(f"🎉 替换完成！共生成 {len(st.session_state.replaced_files)} 个文件", icon="✅")
+            st.success(f"🎉 替换完成！共生成 {len(replaced_files)} 个文件", icon="✅")
             
         except Exception as e:
             st.error(f"❌ 替换过程中发生错误：{str(e)}", icon="❌")
@@ -980,8 +960,10 @@ if len(st.session_state.replaced_files) > 0:
     with st.container(border=True):
         st.subheader("💾 第五步：下载结果")
         
-        # 分页显示结果文件
-        total_pages = (len(st.session_state.replaced_files) + PAGE_SIZE - 1) // PAGE_SIZE
+        # 分页显示结果文件（结果列表与文件数只读取一次）
+        replaced_files = st.session_state.replaced_files
+        file_count = len(replaced_files)
+        total_pages = (file_count + PAGE_SIZE - 1) // PAGE_SIZE
         
         # 页码选择
         col_page = st.columns([1])[0]
@@ -996,31 +978,27 @@ if len(st.session_state.replaced_files) > 0:
         
         # 计算当前页的文件范围
         start_idx = (current_page - 1) * PAGE_SIZE
-        end_idx = min(start_idx + PAGE_SIZE, len(st.session_state.replaced_files))
-        current_files = st.session_state.replaced_files[start_idx:end_idx]
+        current_files = replaced_files[start_idx:start_idx + PAGE_SIZE]
         
         # 显示当前页的文件
-        st.markdown(f"#### 当前页：{current_page}/{total_pages}（共 {len(st.session_state.replaced_files)} 个文件）")
+        st.markdown(f"#### 当前页：{current_page}/{total_pages}（共 {file_count} 个文件）")
         
         # 下载选项
         col_download = st.columns([1])[0]
         with col_download:
             # 批量下载（ZIP压缩）
-            if len(st.session_state.replaced_files) > 1:
-                # 创建临时ZIP文件
-                zip_buffer = io.BytesIO()
-                with zipfile.ZipFile(zip_buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                    for file in st.session_state.replaced_files:
-                        # 将文件添加到ZIP
-                        zipf.writestr(file.filename, file.data.getvalue())
-                
-                zip_buffer.seek(0)
+            if file_count > 1:
+                # 延迟打包：传入可调用对象，仅在用户点击下载时才生成ZIP，页面重新运行时不做任何打包工作
+                # （回调在独立线程中执行，无法访问session_state，因此预先绑定当前结果列表）
+                zip_data = functools.partial(
+                    build_zip, tuple((file.filename, file.path) for file in replaced_files)
+                )
                 
                 # 提供批量下载按钮
                 st.download_button(
-                    label=f"📦 批量下载所有 {len(st.session_state.replaced_files)} 个文件",
-                    data=zip_buffer,
-                    file_name=f"{file_prefix}批量替换结果_{len(st.session_state.replaced_files)}个文件.zip" if file_prefix else f"批量替换结果_{len(st.session_state.replaced_files)}个文件.zip",
+                    label=f"📦 批量下载所有 {file_count} 个文件",
+                    data=zip_data,
+                    file_name=f"{file_prefix}批量替换结果_{file_count}个文件.zip",
                     mime="application/zip",
                     key="download_all"
                 )
@@ -1037,7 +1015,7 @@ if len(st.session_state.replaced_files) > 0:
                 # 单个文件下载
                 st.download_button(
                     label="下载",
-                    data=file.data,
+                    data=functools.partial(read_result_file, file.path),  # 点击下载时才从磁盘读取
                     file_name=file.filename,
                     mime="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
                     key=f"download_{idx}"
@@ -1049,14 +1027,23 @@ if st.session_state.replace_log:
     with st.container(border=True):
         st.subheader("📊 替换日志")
         
-        # 显示日志内容
-        log_content = "\n".join(st.session_state.replace_log)
+        # 显示日志内容（使用替换完成时拼接好的文本，日志较多时只显示最后部分）
+        log_count = len(st.session_state.replace_log)
         st.text_area(
-            "替换详细日志",
-            value=log_content,
+            "替换详细日志" if log_count <= LOG_TAIL_LINES else f"替换详细日志（共 {log_count} 行，仅显示最后 {LOG_TAIL_LINES} 行）",
+            value=st.session_state.replace_log_text,
             height=200,
             key="log_area"
         )
+        
+        # 完整日志仅在点击下载时拼接
+        st.download_button(
+            label="下载完整日志",
+            data=functools.partial("\n".join, st.session_state.replace_log),
+            file_name="替换日志.txt",
+            mime="text/plain",
+            key="download_log"
+        )
 
 # ---------------------- 未满足执行条件的提示 ----------------------
 if not can_replace:
@@ -1075,7 +1062,7 @@ st.markdown("---")
 st.markdown("""
 ### 📝 注意事项
 - 仅支持.docx格式的Word文件
-- 支持表格内文字替换
+- 支持表格、页眉、页脚内文字替换
 - 替换时会保留原文档格式
 - 建议Word文档不要过大，以保证处理效率
 - 对于大量数据（>100行），建议分批处理
@@ -0,0 +1,479 @@
+# Word替换核心逻辑：不依赖Streamlit，可在子进程中独立导入执行
+
+# 导入标准库
+import io
+import os
+import copy
+import re
+import functools
+import multiprocessing
+import traceback
+import unicodedata
+import zipfile
+from bisect import bisect_right
+from itertools import accumulate
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import List, Optional, Dict, Tuple, Iterator, FrozenSet
+
+# 导入第三方库
+from lxml import etree
+
+# 替换范围选项
+SCOPE_FULL_KEYWORD = "替换完整关键词"
+SCOPE_BRACKET_CONTENT = "仅替换括号内内容"
+
+# 支持的括号格式：方括号、中文圆括号、英文圆括号、六角括号
+_BRACKET_PAIRS = (("【", "】"), ("（", "）"), ("(", ")"), ("〔", "〕"))
+
+# WordprocessingML 命名空间与标签
+W_NS = "http://schemas.openxmlformats.org/wordprocessingml/2006/main"
+_W_P = f"{{{W_NS}}}p"  # 段落
+_W_T = f"{{{W_NS}}}t"  # 文本节点
+_W_BR = f"{{{W_NS}}}br"  # 换行
+_W_CR = f"{{{W_NS}}}cr"  # 回车
+_W_TAB = f"{{{W_NS}}}tab"  # 制表符
+_XML_SPACE = "{http://www.w3.org/XML/1998/namespace}space"
+
+# 需要替换文本的文档部件：正文、页眉、页脚、脚注、尾注
+_WORD_TEXT_PART_RE = re.compile(r'^word/(document|header\d*|footer\d*|footnotes|endnotes)\.xml$')
+
+# XML解析器（禁止解析外部实体）
+_XML_PARSER = etree.XMLParser(resolve_entities=False)
+
+# 生成文件的压缩级别：1级压缩速度约为默认6级的数倍，体积仅略大
+_DOCX_COMPRESS_LEVEL = 1
+
+# ---------------------- 核心工具函数 ----------------------
+# 预编译常用正则，避免每次调用时重复解析模式
+_SPECIAL_SPACE_RE = re.compile(r'[\u00A0\u2002-\u200B]')  # 特殊空格
+_WS_RE = re.compile(r'\s+')  # 连续空白
+_BREAK_RE = re.compile(r'(\r\n|[\r\n\t])')  # 替换值中的换行与制表符（\r\n视为一次换行）
+# 文件名非法字符（含控制字符） -> "_"
+_ILLEGAL_FN_TABLE = str.maketrans(dict.fromkeys('\\/:*?"<>|' + "".join(map(chr, range(0x20))), "_"))
+
+
+@functools.lru_cache(maxsize=8192)
+def clean_text(text: str) -> str:
+    """清理文本：去除首尾空白、隐藏字符、特殊空格，统一格式
+    
+    纯函数，结果按输入缓存，同一模板的段落在多行替换中只需清理一次
+    
+    Args:
+        text: 输入文本
+        
+    Returns:
+        清理后的文本
+    """
+    if not isinstance(text, str):
+        return ""
+    text = text.strip()  # 去除首尾空白
+    if not text.isascii():
+        text = unicodedata.normalize("NFKC", text)  # 标准化字符（处理全角/半角等），纯ASCII文本无需处理
+        text = _SPECIAL_SPACE_RE.sub(' ', text)  # 替换特殊空格
+    text = _WS_RE.sub(' ', text)  # 合并连续空格
+    return text
+
+
+def clean_filename(filename: str) -> str:
+    """清理文件名非法字符
+    
+    Args:
+        filename: 原始文件名
+        
+    Returns:
+        清理后的合法文件名
+    """
+    return str(filename).translate(_ILLEGAL_FN_TABLE)
+
+
+# ---------------------- 替换核心逻辑 ----------------------
+def prepare_replace_rules(replace_rules: List[Tuple[str, str]]) -> List[Tuple[str, str, str]]:
+    """预先清理规则关键词，整个批次只需计算一次
+    
+    Args:
+        replace_rules: 替换规则列表
+        
+    Returns:
+        清理后的规则列表：[(原始关键词, 列名, 清理后关键词), ...]
+    """
+    return [(old_text, col_name, clean_text(old_text)) for old_text, col_name in replace_rules]
+
+
+def precompute_replace_patterns(cleaned_rules: List[Tuple[str, str, str]], excel_row: Dict[str, str],
+                                replace_scope: str = SCOPE_FULL_KEYWORD) -> List[Tuple[str, str, str, str]]:
+    """预计算所有需要替换的模式和对应的替换值，减少重复计算
+    
+    Args:
+        cleaned_rules: 预清理的替换规则列表（见prepare_replace_rules）
+        excel_row: 当前处理的Excel行数据（{列名: 值}）
+        replace_scope: 替换范围选项
+        
+    Returns:
+        替换模式列表：[(原始关键词, 列名, 清理后关键词, 替换值), ...]
+    """
+    replace_patterns = []
+    bracket_scope = replace_scope == SCOPE_BRACKET_CONTENT
+    
+    for old_text, col_name, cleaned_text in cleaned_rules:
+        # 获取Excel中对应列的替换值
+        replacement = str(excel_row[col_name])
+        
+        # 仅替换括号内内容时，带括号格式的关键词保留括号、只替换括号内的内容；非括号格式直接替换
+        if bracket_scope:
+            for left, right in _BRACKET_PAIRS:
+                if cleaned_text.startswith(left) and cleaned_text.endswith(right):
+                    replacement = f"{left}{replacement}{right}"
+                    break
+        
+        replace_patterns.append((old_text, col_name, cleaned_text, replacement))
+    
+    return replace_patterns
+
+
+@functools.lru_cache(maxsize=32)
+def _compile_keywords(keywords: Tuple[str, ...]) -> Tuple[re.Pattern, FrozenSet[str]]:
+    """编译关键词正则并收集关键词首字符集合
+    
+    同一批次各行的关键词相同（只有替换值不同），按关键词缓存后整批只需编译一次
+    
+    Args:
+        keywords: 去重后的关键词
+        
+    Returns:
+        (关键词正则, 关键词首字符集合)
+    """
+    # 关键词按长度降序排列，保证重叠时优先匹配最长的关键词
+    ordered = sorted(keywords, key=len, reverse=True)
+    pattern = re.compile("|".join(re.escape(keyword) for keyword in ordered))
+    return pattern, frozenset(keyword[0] for keyword in keywords)
+
+
+def build_keyword_matcher(replace_patterns: List[Tuple[str, str, str, str]]) -> Tuple[Optional[re.Pattern], Dict[str, Tuple[str, Tuple[str, str]]], FrozenSet[str]]:
+    """将所有关键词合并为一个多模式正则，一次扫描即可完成全部关键词的匹配与替换
+    
+    同一关键词对应多条规则时以第一条为准。
+    
+    Args:
+        replace_patterns: 替换模式列表
+        
+    Returns:
+        (关键词正则（无有效关键词时为None）, 关键词映射：{清理后关键词: (替换值, (原始关键词, 列名))}, 关键词首字符集合)
+    """
+    keyword_map = {}
+    for old_text, col_name, format_keyword, replacement in replace_patterns:
+        if format_keyword and format_keyword not in keyword_map:
+            keyword_map[format_keyword] = (replacement, (old_text, col_name))
+    
+    if not keyword_map:
+        return None, keyword_map, frozenset()
+    
+    keyword_pattern, first_chars = _compile_keywords(tuple(keyword_map))
+    return keyword_pattern, keyword_map, first_chars
+
+
+def _set_text_with_breaks(text_elem: etree._Element, text: str):
+    """写入含换行/制表符的文本，与python-docx的Run.text一致：换行写为w:br，制表符写为w:tab
+    
+    第一段文本写回原节点，其余内容作为同一Run内的兄弟节点依次插入其后，沿用该Run的格式。
+    
+    Args:
+        text_elem: 目标w:t元素
+        text: 待写入的文本
+    """
+    pieces = _BREAK_RE.split(text)
+    text_elem.text = pieces[0]
+    text_elem.set(_XML_SPACE, "preserve")
+    
+    prev = text_elem
+    for idx, piece in enumerate(pieces[1:], start=1):
+        if idx % 2:
+            # 奇数位为分隔符
+            new_elem = etree.Element(_W_TAB if piece == "\t" else _W_BR)
+        elif piece:
+            new_elem = etree.Element(_W_T)
+            new_elem.text = piece
+            new_elem.set(_XML_SPACE, "preserve")
+        else:
+            continue
+        prev.addnext(new_elem)
+        prev = new_elem
+
+
+def process_paragraph(text_elems: List[etree._Element], keyword_pattern: re.Pattern,
+                      keyword_map: Dict[str, Tuple[str, Tuple[str, str]]],
+                      first_chars: FrozenSet[str]) -> Dict:
+    """处理单个段落的关键字替换，直接修改段落内的w:t文本节点
+    
+    段落内所有文本节点拼接后统一匹配，可处理被拆分到多个Run中的关键字；
+    替换值写入关键字起点所在的节点（沿用该Run的格式），其余节点中属于关键字的字符被删除，
+    未涉及的文本和格式保持不变。替换值中的换行、制表符写为w:br、w:tab（见_set_text_with_breaks）。
+    
+    Args:
+        text_elems: 段落内的w:t元素列表（按文档顺序，不跨越换行、制表符）
+        keyword_pattern: 关键词正则（见build_keyword_matcher）
+        keyword_map: 关键词映射（见build_keyword_matcher）
+        first_chars: 所有关键词首字符的集合，用于快速排除不含关键词的段落
+        
+    Returns:
+        替换计数字典：{(原始关键词, 列名): 替换次数, ...}
+    """
+    replace_count = defaultdict(int)
+    texts = [elem.text or "" for elem in text_elems]
+    para_text = "".join(texts)
+    # 段落中不含任何关键词的首字符时必然无法匹配，跳过正则扫描（大多数段落走此分支）
+    if not para_text or first_chars.isdisjoint(para_text):
+        return replace_count
+    
+    matches = list(keyword_pattern.finditer(para_text))
+    if not matches:
+        return replace_count
+    
+    # 各节点在拼接文本中的结束位置，用于定位字符所属节点
+    node_ends = list(accumulate(len(text) for text in texts))
+    new_parts = [[] for _ in texts]
+    break_nodes = set()  # 写入了含换行/制表符替换值的节点
+    
+    def _keep(start: int, end: int):
+        """保留[start, end)区间的原文，按节点拆分写回"""
+        idx = bisect_right(node_ends, start)
+        while start < end:
+            seg_end = min(end, node_ends[idx])
+            new_parts[idx].append(para_text[start:seg_end])
+            start = seg_end
+            idx += 1
+    
+    pos = 0
+    for match in matches:
+        _keep(pos, match.start())
+        replacement, key = keyword_map[match.group(0)]
+        node_idx = bisect_right(node_ends, match.start())
+        new_parts[node_idx].append(replacement)
+        if _BREAK_RE.search(replacement):
+            break_nodes.add(node_idx)
+        replace_count[key] += 1
+        pos = match.end()
+    _keep(pos, len(para_text))
+    
+    for node_idx, (elem, old_text, parts) in enumerate(zip(text_elems, texts, new_parts)):
+        new_text = "".join(parts)
+        if node_idx in break_nodes:
+            _set_text_with_breaks(elem, new_text)
+        elif new_text != old_text:
+            elem.text = new_text
+            elem.set(_XML_SPACE, "preserve")  # 保留首尾空格
+    
+    return replace_count
+
+
+def replace_xml_part(template_root: etree._Element, xml_data: bytes, keyword_pattern: re.Pattern,
+                     keyword_map: Dict[str, Tuple[str, Tuple[str, str]]],
+                     first_chars: FrozenSet[str]) -> Tuple[bytes, Dict]:
+    """替换单个文档部件（如word/document.xml）中的关键字
+    
+    在模板XML树的副本上替换，模板树本身保持不变，可供后续各行重复使用
+    
+    Args:
+        template_root: 已解析的部件XML根节点（见_load_template）
+        xml_data: 部件XML内容
+        keyword_pattern: 关键词正则（见build_keyword_matcher）
+        keyword_map: 关键词映射（见build_keyword_matcher）
+        first_chars: 所有关键词首字符的集合
+        
+    Returns:
+        (替换后的XML内容（无替换时原样返回）, 替换计数字典)
+    """
+    root = copy.deepcopy(template_root)  # 复制已解析的树，比重新解析XML快
+    
+    # 一次遍历收集所有文本节点，按所属段落（最近的w:p祖先）分组，嵌套文本框中的段落单独处理；
+    # 段落内遇到换行、回车、制表符时另起一段，关键词不会跨越这些元素匹配（与段落文本中的\n、\t一致）
+    paragraphs = defaultdict(lambda: [[]])
+    for elem in root.iter(_W_T, _W_BR, _W_CR, _W_TAB):
+        owner = elem.getparent()
+        while owner is not None and owner.tag != _W_P:
+            owner = owner.getparent()
+        if owner is None:
+            continue
+        segments = paragraphs[owner]
+        if elem.tag == _W_T:
+            segments[-1].append(elem)
+        elif segments[-1]:
+            segments.append([])
+    
+    replace_count = defaultdict(int)
+    for segments in paragraphs.values():
+        for text_elems in segments:
+            for key, count in process_paragraph(text_elems, keyword_pattern, keyword_map, first_chars).items():
+                replace_count[key] += count
+    
+    if not replace_count:
+        return xml_data, replace_count
+    return etree.tostring(root, xml_declaration=True, encoding="UTF-8", standalone=True), replace_count
+
+
+@functools.lru_cache(maxsize=2)
+def _load_template(word_bytes: bytes) -> List[Tuple[zipfile.ZipInfo, bytes, Optional[etree._Element]]]:
+    """解压Word模板并解析其中包含文本的文档部件
+    
+    同一批次各行使用同一模板，按内容缓存后每个进程只需解压、解析一次
+    
+    Args:
+        word_bytes: Word模板文件内容
+        
+    Returns:
+        [(条目信息, 条目内容, XML根节点（非文本部件为None）), ...]
+    """
+    entries = []
+    with zipfile.ZipFile(io.BytesIO(word_bytes)) as zin:
+        for item in zin.infolist():
+            data = zin.read(item)
+            root = etree.fromstring(data, _XML_PARSER) if _WORD_TEXT_PART_RE.match(item.filename) else None
+            entries.append((item, data, root))
+    return entries
+
+
+def replace_word_with_format(word_bytes: bytes,
+                          excel_row: Dict[str, str],
+                          cleaned_rules: List[Tuple[str, str, str]],
+                          replace_scope: str = SCOPE_FULL_KEYWORD) -> Tuple[bytes, str]:
+    """替换Word文件中的关键字，保留格式并返回替换后的文件
+    
+    直接在.docx压缩包内的XML上操作（不构建python-docx对象模型），
+    覆盖正文（含表格）、页眉、页脚、脚注与尾注。
+    
+    Args:
+        word_bytes: Word模板文件内容
+        excel_row: 当前Excel行数据（{列名: 值}）
+        cleaned_rules: 预清理的替换规则列表（见prepare_replace_rules）
+        replace_scope: 替换范围选项
+        
+    Returns:
+        (替换后的文件数据, 替换日志)
+    """
+    replace_count = defaultdict(int)
+    replace_log = []
+    
+    try:
+        # 预计算替换模式，减少重复计算（优化性能）
+        replace_patterns = precompute_replace_patterns(cleaned_rules, excel_row, replace_scope)
+        keyword_pattern, keyword_map, first_chars = build_keyword_matcher(replace_patterns)
+        
+        # 逐个写出模板条目（已解压、解析并缓存），仅替换包含文本的文档部件；压缩条目统一使用低压缩级别
+        output_file = io.BytesIO()
+        with zipfile.ZipFile(output_file, "w", zipfile.ZIP_DEFLATED) as zout:
+            for item, data, template_root in _load_template(word_bytes):
+                if keyword_pattern is not None and template_root is not None:
+                    data, part_count = replace_xml_part(template_root, data, keyword_pattern, keyword_map, first_chars)
+                    for key, count in part_count.items():
+                        replace_count[key] += count
+                # 写入时会修改条目信息（大小、偏移等），使用副本以免影响缓存的模板
+                zout.writestr(copy.copy(item), data, compresslevel=_DOCX_COMPRESS_LEVEL)
+        
+        # 生成替换日志
+        if replace_count:
+            log_lines = [f"替换成功: {old} -> {excel_row[col_name]} ({count}次)" 
+                        for (old, col_name), count in replace_count.items()]
+            replace_log = "\n".join(log_lines)
+        else:
+            replace_log = "未找到需要替换的关键字"
+            
+        return output_file.getvalue(), replace_log
+        
+    except Exception as e:
+        # 生成详细错误日志
+        error_log = f"替换失败: {str(e)}\n{traceback.format_exc()}"
+        return b"", error_log
+
+
+# ---------------------- 多进程批量替换 ----------------------
+# 并行进程数上限：避免在核数很多的服务器上为单个会话占用过多进程和内存
+_MAX_WORKERS = 8
+
+# 子进程持有的批次共享数据（由_init_worker设置）
+_worker_word_bytes = b""  # Word模板内容
+_worker_cleaned_rules: List[Tuple[str, str, str]] = []  # 预清理的替换规则
+_worker_replace_scope = SCOPE_FULL_KEYWORD  # 替换范围选项
+
+
+def _init_worker(word_bytes: bytes, cleaned_rules: List[Tuple[str, str, str]], replace_scope: str):
+    """子进程初始化：模板与规则等批次共享数据只传输一次，每个任务只需传递行数据"""
+    global _worker_word_bytes, _worker_cleaned_rules, _worker_replace_scope
+    _worker_word_bytes = word_bytes
+    _worker_cleaned_rules = cleaned_rules
+    _worker_replace_scope = replace_scope
+
+
+def _process_row(row_idx: int, excel_row: Dict[str, str]) -> Tuple[int, bytes, str]:
+    """子进程任务：替换单行数据，返回(行号, 替换后的文件数据, 替换日志)"""
+    replaced_file, replace_log = replace_word_with_format(_worker_word_bytes, excel_row,
+                                                          _worker_cleaned_rules, _worker_replace_scope)
+    return row_idx, replaced_file, replace_log
+
+
+def _available_cpus() -> int:
+    """获取当前进程可用的CPU数量（考虑CPU亲和性设置，如容器的cpuset限制）"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _get_mp_context():
+    """获取多进程上下文
+    
+    仅使用fork方式：Streamlit以伪__main__模块运行脚本，spawn和forkserver方式的子进程
+    启动时都会按主模块路径重新执行整个页面脚本。
+    不支持fork的平台（如Windows）返回None，退回线程池处理。
+    
+    在多线程的Streamlit服务进程中fork是安全的：子进程只执行本模块的替换代码（lxml、zipfile、zlib、re），
+    不使用其他线程的状态。解释器锁、导入锁和logging的锁由CPython在fork后重新初始化，
+    libc的malloc在fork前后自行加锁、解锁，lxml的解析器字典按线程分配，子进程只使用发起fork的线程的字典，
+    其他线程fork时持有的锁在子进程中不会被用到。
+    """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return None
+
+
+def replace_rows(word_bytes: bytes,
+                 rows: List[Tuple[int, Dict[str, str]]],
+                 cleaned_rules: List[Tuple[str, str, str]],
+                 replace_scope: str = SCOPE_FULL_KEYWORD) -> Iterator[Tuple[int, bytes, str]]:
+    """批量替换多行数据，各行相互独立，使用进程池（不支持fork时为线程池）并行处理
+    
+    Args:
+        word_bytes: Word模板文件内容
+        rows: 待处理的行列表：[(行号, {列名: 值}), ...]
+        cleaned_rules: 预清理的替换规则列表（见prepare_replace_rules）
+        replace_scope: 替换范围选项
+        
+    Yields:
+        (行号, 替换后的文件数据, 替换日志)，按rows顺序产出
+    """
+    mp_context = _get_mp_context()
+    max_workers = min(_available_cpus(), _MAX_WORKERS, len(rows))
+    
+    # 单行或单核时直接在当前进程处理
+    if max_workers <= 1:
+        for row_idx, excel_row in rows:
+            replaced_file, replace_log = replace_word_with_format(word_bytes, excel_row, cleaned_rules, replace_scope)
+            yield row_idx, replaced_file, replace_log
+        return
+    
+    # 不支持fork时退回线程池：XML解析、序列化和zlib压缩在C代码中执行并释放GIL，仍可部分并行
+    if mp_context is None:
+        def process(row):
+            row_idx, excel_row = row
+            replaced_file, replace_log = replace_word_with_format(word_bytes, excel_row, cleaned_rules, replace_scope)
+            return row_idx, replaced_file, replace_log
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            yield from executor.map(process, rows)
+        return
+    
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=mp_context,
+                             initializer=_init_worker,
+                             initargs=(word_bytes, cleaned_rules, replace_scope)) as executor:
+        # 按块分发任务，摊薄每个任务的进程间通信开销；每个进程约分到4块，兼顾负载均衡
+        chunksize = max(1, len(rows) // (4 * max_workers))
+        row_indices, excel_rows = zip(*rows)
+        yield from executor.map(_process_row, row_indices, excel_rows, chunksize=chunksize)